@@ -3,6 +3,29 @@ import chess
 import random
 import time
 import math
+import os
+import sys
+import io
+import json
+import argparse
+import signal
+import multiprocessing
+import sqlite3
+import chess.pgn
+import chess.polyglot
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for the optional NNUE evaluator
+    np = None
+
+# Command-line modes and worker processes run headless, so don't open a real window
+HEADLESS_FLAGS = ("--analyze", "--import-pgn", "--self-play", "--bench-playouts")
+if any(flag in sys.argv for flag in HEADLESS_FLAGS) or multiprocessing.parent_process() is not None:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_NO_SIGNAL_HANDLERS", "1")  # Keep Ctrl+C as KeyboardInterrupt
 
 # Initialize Pygame
 pygame.init()
@@ -23,16 +46,124 @@ PANEL_BG = (45, 45, 45)                # Dark gray panel
 TEXT_COLOR = (255, 255, 255)           # White text
 BUTTON_COLOR = (70, 70, 70)            # Button background
 BUTTON_HOVER = (90, 90, 90)            # Button hover color
+MIN_SQUARE_SIZE = 75                   # Smallest board the panel layout fits next to
+ASSET_CACHE_SIZE = 4                   # Scaled piece atlases kept for recent sizes
+
+# Time control
+TIME_CONTROL_BASE = 180                # Seconds per side
+TIME_CONTROL_INCREMENT = 2             # Seconds added after each move
+TIME_MOVE_OVERHEAD = 0.1               # Seconds kept in reserve for GUI latency
+TIME_MOVES_TO_GO = 40                  # Assumed moves left at the start of the game
+TIME_MIN_MOVES_TO_GO = 15              # Never plan for fewer moves than this
+TIME_HARD_FACTOR = 3.0                 # Hard limit as a multiple of the soft budget
+TIME_HARD_FRACTION = 0.5               # Never spend more than this share of the clock
+TIME_DOMINANT_MARGIN = 2.0             # Eval gap (pawns) where one move clearly dominates
+TIME_ITERATION_GROWTH = 4              # Expected cost of the next iteration vs. time so far
+CLOCK_LOW_TIME = 10                    # Below this, show tenths and skip the AI delay
+
+# Experience store
+EXPERIENCE_PATH = "experience.db"      # SQLite file next to where the game is run
+EXPERIENCE_MAX_PLY = 24                # Only the opening is recorded
+EXPERIENCE_BATCH_SIZE = 500            # Buffered moves per write transaction
+EXPERIENCE_MAX_ENTRIES = 200000        # Prune rarely visited moves beyond this
+EXPERIENCE_PRUNE_TO = 0.9              # Fraction of the limit kept after pruning
+EXPERIENCE_MIN_VISITS = 3              # Games needed before a move is trusted
+EXPERIENCE_MIN_EXPECTATION = 0.5       # Only play known moves that score at least this
+SELF_PLAY_BASE = 60                    # Self-play clock, seconds per side
+SELF_PLAY_INCREMENT = 0.5
+SELF_PLAY_MAX_PLIES = 200              # Adjudicate longer self-play games as unfinished
+SELF_PLAY_SCORE_DEPTH = 1              # Search below book and exploration moves for their score
 
-WINDOW = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+# MCTS playouts
+PLAYOUT_MAX_PLIES = 80                 # Adjudicate a playout after this many plies
+PLAYOUT_WIN_MARGIN = 3                 # Material lead (pawns) counted as a win at the cap
+PLAYOUT_PIECE_VALUES = [(chess.PAWN, 1), (chess.KNIGHT, 3), (chess.BISHOP, 3),
+                        (chess.ROOK, 5), (chess.QUEEN, 9)]
+PLAYOUT_BENCH_FENS = [
+    chess.STARTING_FEN,
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "r2q1rk1/pp2bppp/2n1pn2/3p4/3P4/2NBPN2/PP3PPP/R2Q1RK1 w - - 0 10",
+    "8/5pk1/6p1/8/3R4/6P1/5PK1/r7 w - - 0 40",
+]
+
+# Analysis settings
+MATE_SCORE = 1000                      # Score for a forced mate
+QUIESCENCE_MAX_PLIES = 4               # Captures searched past the nominal depth
+EVAL_SYMMETRY_TOLERANCE = 0.01         # Max |eval(b) + eval(b.mirror())| for a search evaluation
+MISTAKE_THRESHOLD = 1.0                # Eval loss (pawns) flagged as a mistake
+BLUNDER_THRESHOLD = 2.0                # Eval loss (pawns) flagged as a blunder
+BLUNDER_MIN_DEPTH = 3                  # Shallower analysis flags blunders as mistakes
+ANALYSIS_REPORT_EVERY = 25             # Print throughput every N games
+ANALYSIS_GUI_DEPTH = 2                 # Search depth of the in-game background analysis
+ANALYSIS_GUI_NICENESS = 10             # Worker process priority (Unix nice value)
+ANALYSIS_GRAPH_HEIGHT = 60             # Pixels
+ANALYSIS_GRAPH_CLAMP = 10              # Pawns; larger scores and mates are drawn at this limit
+ARROW_COLOR = (0, 120, 255, 160)       # Best-move arrow
+
+WINDOW = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.RESIZABLE)
 pygame.display.set_caption("Enhanced Chess Game")
 FONT_LARGE = pygame.font.Font(pygame.font.match_font("arial"), 24)
 FONT_MEDIUM = pygame.font.Font(pygame.font.match_font("arial"), 18)
 FONT_SMALL = pygame.font.Font(pygame.font.match_font("arial"), 14)
 
+class AssetManager:
+    """Piece sprites packed into one display-format atlas, with an LRU of scaled copies"""
+    def __init__(self, piece_paths, cache_size=ASSET_CACHE_SIZE):
+        start_time = time.perf_counter()
+        images = [(symbol, pygame.image.load(path).convert_alpha()) for symbol, path in piece_paths]
+        self.symbols = [symbol for symbol, image in images]
+        self.sprite_size = max(max(image.get_size()) for symbol, image in images)
+        
+        # One row per color, converted once to the display pixel format
+        self.columns = (len(images) + 1) // 2
+        self.atlas = pygame.Surface(
+            (self.sprite_size * self.columns, self.sprite_size * 2), pygame.SRCALPHA
+        ).convert_alpha()
+        self.atlas.fill((0, 0, 0, 0))
+        self.cells = {}
+        for i, (symbol, image) in enumerate(images):
+            cell = (i % self.columns, i // self.columns)
+            self.cells[symbol] = cell
+            image_rect = image.get_rect(center=(
+                cell[0] * self.sprite_size + self.sprite_size // 2,
+                cell[1] * self.sprite_size + self.sprite_size // 2,
+            ))
+            self.atlas.blit(image, image_rect)
+        
+        self.cache_size = cache_size
+        self.scaled = OrderedDict()  # square size -> (atlas, {symbol: subsurface})
+        self.load_time = time.perf_counter() - start_time
+    
+    def sprites(self, square_size):
+        """Sprites for one square size, scaled once and reused until evicted"""
+        if square_size in self.scaled:
+            self.scaled.move_to_end(square_size)
+            return self.scaled[square_size][1]
+        
+        # Scale cell by cell so neighbouring sprites never bleed into each other
+        atlas = pygame.Surface(
+            (square_size * self.columns, square_size * 2), pygame.SRCALPHA
+        ).convert_alpha()
+        atlas.fill((0, 0, 0, 0))
+        sprites = {}
+        for symbol, (col, row) in self.cells.items():
+            source = self.atlas.subsurface(
+                (col * self.sprite_size, row * self.sprite_size, self.sprite_size, self.sprite_size)
+            )
+            area = (col * square_size, row * square_size, square_size, square_size)
+            atlas.blit(pygame.transform.smoothscale(source, (square_size, square_size)), area)
+            sprites[symbol] = atlas.subsurface(area)
+        
+        self.scaled[square_size] = (atlas, sprites)
+        if len(self.scaled) > self.cache_size:
+            self.scaled.popitem(last=False)
+        return sprites
+    
+    def piece(self, symbol, square_size):
+        return self.sprites(square_size)[symbol]
+
 # Load piece images
-PIECES = {}
-for piece, path in [
+ASSETS = AssetManager([
     ("K", "assets/white/wk.png"),
     ("Q", "assets/white/wq.png"),
     ("R", "assets/white/wr.png"),
@@ -45,10 +176,16 @@ for piece, path in [
     ("b", "assets/black/bb.png"),
     ("n", "assets/black/bn.png"),
     ("p", "assets/black/bp.png"),
-]:
-    PIECES[piece] = pygame.transform.scale(
-        pygame.image.load(path), (SQUARE_SIZE, SQUARE_SIZE)
-    )
+])
+
+def resize_window(width, height):
+    """Fit the board to a resized window, snapping to whole squares"""
+    global WINDOW, BOARD_SIZE, SQUARE_SIZE, WINDOW_WIDTH, WINDOW_HEIGHT
+    SQUARE_SIZE = max(MIN_SQUARE_SIZE, min(height, width - PANEL_WIDTH) // 8)
+    BOARD_SIZE = SQUARE_SIZE * 8
+    WINDOW_WIDTH = BOARD_SIZE + PANEL_WIDTH
+    WINDOW_HEIGHT = BOARD_SIZE
+    WINDOW = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.RESIZABLE)
 
 class Button:
     def __init__(self, x, y, width, height, text, font=FONT_MEDIUM):
@@ -88,6 +225,35 @@ class GameState:
         self.animation_time = 0
         self.animation_duration = 0.3  # seconds
         self.ai_last_moves = []  # Track AI's last few moves to prevent repetition
+        self.evaluate = evaluate_board_advanced  # Hard AI move ranking
+        self.search_evaluate = evaluate_centered  # Hard AI search leaves, must be antisymmetric
+        self.search_scores = {}  # Ply -> White's-view search score of the AI's move
+        self.recorded = False  # Game saved to the experience store
+        self.increment = TIME_CONTROL_INCREMENT
+        self.clock = {chess.WHITE: TIME_CONTROL_BASE, chess.BLACK: TIME_CONTROL_BASE}
+        self.turn_start = time.time()  # When the side to move started thinking
+
+def remaining_time(game_state, color):
+    """Seconds left on a player's clock, counting the current turn"""
+    remaining = game_state.clock[color]
+    if color == game_state.board.turn and not game_state.game_over:
+        remaining -= time.time() - game_state.turn_start
+    return remaining
+
+def press_clock(game_state, color):
+    """Charge the player who just moved and add the increment"""
+    now = time.time()
+    game_state.clock[color] -= now - game_state.turn_start
+    game_state.clock[color] += game_state.increment
+    game_state.turn_start = now
+
+def format_clock(seconds):
+    """Format clock time as m:ss, with tenths when time is low"""
+    seconds = max(0.0, seconds)
+    if seconds < CLOCK_LOW_TIME:
+        return f"0:{seconds:04.1f}"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
 
 def draw_gradient_background(surface, color1, color2):
     """Draw a gradient background"""
@@ -123,6 +289,7 @@ def draw_board():
 
 def draw_pieces(board, game_state):
     """Draw pieces with animation support"""
+    sprites = ASSETS.sprites(SQUARE_SIZE)
     for square in chess.SQUARES:
         piece = board.piece_at(square)
         if piece:
@@ -139,7 +306,7 @@ def draw_pieces(board, game_state):
             
             x = col * SQUARE_SIZE + offset_x
             y = row * SQUARE_SIZE + offset_y
-            WINDOW.blit(PIECES[str(piece)], (x, y))
+            WINDOW.blit(sprites[piece.symbol()], (x, y))
 
 def highlight_squares(board, game_state):
     """Enhanced highlighting with multiple colors"""
@@ -178,7 +345,7 @@ def highlight_squares(board, game_state):
             pygame.draw.rect(highlight_surface, CHECK_HIGHLIGHT, (0, 0, SQUARE_SIZE, SQUARE_SIZE))
             WINDOW.blit(highlight_surface, (col * SQUARE_SIZE, row * SQUARE_SIZE))
 
-def draw_panel(game_state):
+def draw_panel(game_state, analyzer=None):
     """Draw the side panel with game information"""
     panel_x = BOARD_SIZE
     
@@ -199,6 +366,19 @@ def draw_panel(game_state):
     # Current player
     player_text = FONT_MEDIUM.render(f"Current Player: {game_state.current_player}", True, TEXT_COLOR)
     WINDOW.blit(player_text, (panel_x + 10, y_offset))
+    y_offset += 30
+    
+    # Clocks (side to move highlighted)
+    for i, (name, color) in enumerate([("White", chess.WHITE), ("Black", chess.BLACK)]):
+        remaining = remaining_time(game_state, color)
+        if remaining < CLOCK_LOW_TIME:
+            clock_color = (255, 0, 0)
+        elif color == game_state.board.turn and not game_state.game_over:
+            clock_color = (255, 255, 0)
+        else:
+            clock_color = TEXT_COLOR
+        clock_text = FONT_MEDIUM.render(f"{name}: {format_clock(remaining)}", True, clock_color)
+        WINDOW.blit(clock_text, (panel_x + 10 + i * 140, y_offset))
     y_offset += 40
     
     # Game status
@@ -229,6 +409,76 @@ def draw_panel(game_state):
         move_text = FONT_SMALL.render(f"{len(game_state.move_history) - max_moves + i + 1}. {san_move}", True, TEXT_COLOR)
         WINDOW.blit(move_text, (panel_x + 10, y_offset))
         y_offset += 20
+    
+    # Background analysis below the buttons
+    if analyzer is not None and analyzer.enabled:
+        result = analyzer.current()
+        if result is None:
+            eval_label = "Analyzing..."
+        else:
+            score, best_move = result
+            if mate_in(score, analyzer.depth) is None:
+                eval_label = f"Eval: {score:+.2f}"
+            else:
+                eval_label = f"Eval: {format_eval(score, analyzer.depth)}"
+            if best_move:
+                eval_label += f"  Best: {game_state.board.san(chess.Move.from_uci(best_move))}"
+        eval_text = FONT_SMALL.render(eval_label, True, TEXT_COLOR)
+        WINDOW.blit(eval_text, (panel_x + 10, WINDOW_HEIGHT - ANALYSIS_GRAPH_HEIGHT - 30))
+        draw_analysis_graph(analyzer, panel_x, WINDOW_HEIGHT - ANALYSIS_GRAPH_HEIGHT - 10)
+
+def draw_analysis_graph(analyzer, panel_x, y):
+    """Evaluation graph of the game, re-rendered only when the analysis changes"""
+    width = PANEL_WIDTH - 20
+    cache_key = (analyzer.version, width)
+    if analyzer.graph_key != cache_key:
+        graph = pygame.Surface((width, ANALYSIS_GRAPH_HEIGHT))
+        graph.fill((30, 30, 30))
+        scores = [max(-ANALYSIS_GRAPH_CLAMP, min(ANALYSIS_GRAPH_CLAMP, analyzer.results[key][0]))
+                  if key in analyzer.results else None
+                  for key in analyzer.game_keys]
+        known = [score for score in scores if score is not None]
+        if known:
+            # Scale to the scores seen so far, so that a mate does not flatten the rest
+            low, high = min(known + [0]), max(known + [0])
+            span = max(high - low, 1e-9)
+            to_y = lambda score: int((high - score) / span * (ANALYSIS_GRAPH_HEIGHT - 1))
+            pygame.draw.line(graph, (90, 90, 90), (0, to_y(0)), (width, to_y(0)))
+            step = width / max(1, len(scores) - 1)
+            points = [(int(i * step), to_y(score)) for i, score in enumerate(scores) if score is not None]
+            if len(points) > 1:
+                pygame.draw.lines(graph, (255, 255, 255), False, points, 2)
+            pygame.draw.circle(graph, (255, 255, 0), points[-1], 3)
+        pygame.draw.rect(graph, (100, 100, 100), graph.get_rect(), 1)
+        analyzer.graph_surface = graph
+        analyzer.graph_key = cache_key
+    WINDOW.blit(analyzer.graph_surface, (panel_x + 10, y))
+
+def draw_best_move_arrow(analyzer):
+    """Overlay an arrow for the engine's best move, rebuilt only when it changes"""
+    result = analyzer.current()
+    best_move = result[1] if result else None
+    cache_key = (best_move, SQUARE_SIZE)
+    if analyzer.arrow_key != cache_key:
+        overlay = None
+        if best_move:
+            move = chess.Move.from_uci(best_move)
+            overlay = pygame.Surface((BOARD_SIZE, BOARD_SIZE), pygame.SRCALPHA)
+            start = pygame.Vector2((move.from_square % 8 + 0.5) * SQUARE_SIZE,
+                                   (move.from_square // 8 + 0.5) * SQUARE_SIZE)
+            end = pygame.Vector2((move.to_square % 8 + 0.5) * SQUARE_SIZE,
+                                 (move.to_square // 8 + 0.5) * SQUARE_SIZE)
+            direction = (end - start).normalize()
+            normal = pygame.Vector2(-direction.y, direction.x)
+            head = SQUARE_SIZE * 0.3
+            pygame.draw.line(overlay, ARROW_COLOR, start, end - direction * head, max(2, SQUARE_SIZE // 10))
+            pygame.draw.polygon(overlay, ARROW_COLOR, [
+                end, end - direction * head + normal * head * 0.6, end - direction * head - normal * head * 0.6
+            ])
+        analyzer.arrow_surface = overlay
+        analyzer.arrow_key = cache_key
+    if analyzer.arrow_surface is not None:
+        WINDOW.blit(analyzer.arrow_surface, (0, 0))
 
 def create_buttons():
     """Create game control buttons"""
@@ -335,9 +585,9 @@ def welcome_menu():
     
     # Draw chess pieces as decoration
     for i in range(4):
-        piece_key = list(PIECES.keys())[i]
-        WINDOW.blit(PIECES[piece_key], (50 + i*100, 50))
-        WINDOW.blit(PIECES[piece_key.lower()], (50 + i*100, WINDOW_HEIGHT - 100))
+        piece_key = ASSETS.symbols[i]
+        WINDOW.blit(ASSETS.piece(piece_key, SQUARE_SIZE), (50 + i*100, 50))
+        WINDOW.blit(ASSETS.piece(piece_key.lower(), SQUARE_SIZE), (50 + i*100, WINDOW_HEIGHT - 100))
     
     title_text = FONT_LARGE.render("Enhanced Chess Game", True, TEXT_COLOR)
     title_rect = title_text.get_rect(center=(WINDOW_WIDTH//2, WINDOW_HEIGHT//3))
@@ -409,36 +659,251 @@ def level_selection_menu():
                 elif event.key == pygame.K_3:
                     return "hard"
 
-def ai_move_mcts(board, time_limit=5):
+class TimeManager:
+    """Per-move time budget for the AI from the clock, move number and search stability"""
+    def __init__(self, remaining, increment, move_number, legal_move_count):
+        self.start_time = time.time()
+        usable = max(0.0, remaining - TIME_MOVE_OVERHEAD)
+        moves_to_go = max(TIME_MIN_MOVES_TO_GO, TIME_MOVES_TO_GO - move_number)  # move_number counts full moves
+        budget = usable / moves_to_go + increment * 0.75
+        
+        self.hard_limit = min(budget * TIME_HARD_FACTOR, usable * TIME_HARD_FRACTION)
+        self.soft_limit = min(budget, self.hard_limit)
+        if legal_move_count <= 1:
+            self.soft_limit = 0  # Only one reply, don't think
+        self.stability = 1.0  # > 1 while the best move keeps changing
+        self.best_move = None
+        self.iterations = 0
+    
+    def elapsed(self):
+        return time.time() - self.start_time
+    
+    def deadline(self):
+        """Absolute time at which the search must stop"""
+        return self.start_time + self.hard_limit
+    
+    def record_iteration(self, best_move, margin=None):
+        """Adjust the budget after a finished iteration"""
+        if self.best_move is not None:
+            if best_move != self.best_move:
+                self.stability = min(2.5, self.stability * 1.6)  # Unstable, think longer
+            else:
+                self.stability = max(0.5, self.stability * 0.85)
+        if margin is not None and margin >= TIME_DOMINANT_MARGIN:
+            self.stability = min(self.stability, 0.5)  # One move dominates
+        self.best_move = best_move
+        self.iterations += 1
+    
+    def should_start_iteration(self):
+        """Start another iteration only if it is likely to finish within the budget"""
+        elapsed = self.elapsed()
+        # Each iteration costs several times everything before it
+        return (elapsed < self.hard_limit and
+                elapsed * TIME_ITERATION_GROWTH < self.soft_limit * self.stability)
+
+class PlayoutEngine:
+    """Light random playouts for MCTS, played and undone on a single board"""
+    def __init__(self, max_plies=PLAYOUT_MAX_PLIES, seed=None):
+        self.max_plies = max_plies
+        self.moves = []  # Move buffer reused by every ply of every playout
+        self.random = random.Random(seed)
+        self.playouts = 0
+        self.plies = 0
+    
+    def material(self, board):
+        """Material balance in pawns from White's point of view"""
+        white = board.occupied_co[chess.WHITE]
+        balance = 0
+        for piece_type, value in PLAYOUT_PIECE_VALUES:
+            pieces = board.pieces_mask(piece_type, chess.WHITE) | board.pieces_mask(piece_type, chess.BLACK)
+            balance += value * (chess.popcount(pieces & white) - chess.popcount(pieces & ~white))
+        return balance
+    
+    def playout(self, board):
+        """Random game from this position: 1 White wins, -1 Black wins, 0 draw
+        
+        Moves are generated pseudo-legally and only the chosen move is
+        checked, by testing whether it leaves the mover's king attacked.
+        The board is restored before returning.
+        """
+        moves = self.moves
+        randrange = self.random.randrange
+        pushed = 0
+        result = None
+        try:
+            while pushed < self.max_plies:
+                if board.halfmove_clock >= 100:
+                    result = 0
+                    break
+                
+                mover = board.turn
+                king = board.king(mover)
+                moves.clear()
+                moves.extend(board.generate_pseudo_legal_moves())
+                while moves:
+                    # Draw without replacement: swap the pick with the last move
+                    index = randrange(len(moves))
+                    move = moves[index]
+                    moves[index] = moves[-1]
+                    moves.pop()
+                    
+                    board.push(move)
+                    king_square = move.to_square if move.from_square == king else king
+                    if not board.is_attacked_by(board.turn, king_square):
+                        pushed += 1
+                        break
+                    board.pop()  # Would leave the king in check
+                else:
+                    # No legal move: checkmate or stalemate
+                    if board.is_check():
+                        result = -1 if mover == chess.WHITE else 1
+                    else:
+                        result = 0
+                    break
+                
+                if chess.popcount(board.occupied) <= 4 and board.is_insufficient_material():
+                    result = 0
+                    break
+            
+            if result is None:
+                # Ply cap reached: adjudicate on material
+                balance = self.material(board)
+                if balance >= PLAYOUT_WIN_MARGIN:
+                    result = 1
+                elif balance <= -PLAYOUT_WIN_MARGIN:
+                    result = -1
+                else:
+                    result = 0
+        finally:
+            for _ in range(pushed):
+                board.pop()
+        
+        self.playouts += 1
+        self.plies += pushed
+        return result
+
+def benchmark_playouts(seconds_per_position=3.0):
+    """Playouts per second of the MCTS playout engine on fixed positions"""
+    engine = PlayoutEngine(seed=0)
+    for fen in PLAYOUT_BENCH_FENS:
+        board = chess.Board(fen)
+        root_moves = list(board.legal_moves)
+        playouts = 0
+        start_time = time.perf_counter()
+        while time.perf_counter() - start_time < seconds_per_position:
+            for move in root_moves:
+                board.push(move)
+                engine.playout(board)
+                board.pop()
+                playouts += 1
+        elapsed = time.perf_counter() - start_time
+        print(f"{playouts / elapsed:8.1f} playouts/s  {fen}")
+
+def ai_move_mcts(board, time_limit=5, time_manager=None):
     """Enhanced AI move with better time management"""
     start_time = time.time()
     move_scores = {move: 0 for move in board.legal_moves}
     move_counts = {move: 0 for move in board.legal_moves}
+    engine = PlayoutEngine()
+    sign = 1 if board.turn == chess.WHITE else -1  # Playout results are from White's view
+    
+    def current_best():
+        return max(
+            move_scores,
+            key=lambda m: (
+                move_scores[m] / move_counts[m] if move_counts[m] > 0 else float("-inf")
+            ),
+        )
     
-    def simulate(board_copy):
-        while not board_copy.is_game_over():
-            move = random.choice(list(board_copy.legal_moves))
-            board_copy.push(move)
+    # A time manager replaces the fixed limit with an adaptive budget
+    if time_manager is not None:
+        time_limit = time_manager.hard_limit
     
     while time.time() - start_time < time_limit:
+        if time_manager is not None and not time_manager.should_start_iteration():
+            break
         for move in move_scores.keys():
-            board_copy = board.copy()
-            board_copy.push(move)
-            simulate(board_copy)
-            
-            if board_copy.result() == "1-0":
-                move_scores[move] += 1
-            elif board_copy.result() == "0-1":
-                move_scores[move] -= 1
+            if time.time() - start_time >= time_limit:
+                break  # Hard stop
+            # Play out on the board itself, the engine undoes its own moves
+            board.push(move)
+            try:
+                move_scores[move] += sign * engine.playout(board)
+            finally:
+                board.pop()
             move_counts[move] += 1
+        
+        if time_manager is not None:
+            time_manager.record_iteration(current_best())
     
-    best_move = max(
-        move_scores,
-        key=lambda m: (
-            move_scores[m] / move_counts[m] if move_counts[m] > 0 else float("-inf")
-        ),
-    )
-    return best_move
+    return current_best()
+
+# Aggressive piece-square tables for attacking play
+PAWN_TABLE = [
+    0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    20, 20, 30, 40, 40, 30, 20, 20,  # More aggressive pawn advancement
+    15, 15, 25, 35, 35, 25, 15, 15,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5,  5, 15, 25, 25, 15,  5,  5,
+    0,  0, 10, 20, 20, 10,  0,  0,
+    0,  0,  0,  0,  0,  0,  0,  0
+]
+
+KNIGHT_TABLE = [
+    -50,-40,-30,-30,-30,-30,-40,-50,
+    -40,-20,  0,  5,  5,  0,-20,-40,  # More aggressive knight positioning
+    -30,  5, 15, 20, 20, 15,  5,-30,
+    -30,  0, 20, 25, 25, 20,  0,-30,
+    -30,  5, 20, 25, 25, 20,  5,-30,
+    -30,  0, 15, 20, 20, 15,  0,-30,
+    -40,-20,  0,  5,  5,  0,-20,-40,
+    -50,-40,-30,-30,-30,-30,-40,-50
+]
+
+BISHOP_TABLE = [
+    -20,-10,-10,-10,-10,-10,-10,-20,
+    -10,  5,  0,  0,  0,  0,  5,-10,  # More aggressive bishop positioning
+    -10, 10, 10, 10, 10, 10, 10,-10,
+    -10,  0, 10, 10, 10, 10,  0,-10,
+    -10,  5,  5, 10, 10,  5,  5,-10,
+    -10,  0,  5, 10, 10,  5,  0,-10,
+    -10,  5,  0,  0,  0,  0,  5,-10,
+    -20,-10,-10,-10,-10,-10,-10,-20
+]
+
+ROOK_TABLE = [
+    0,  0,  0,  0,  0,  0,  0,  0,
+    5, 10, 10, 10, 10, 10, 10,  5,
+    0,  0,  0,  0,  0,  0,  0,  0,  # Rooks prefer open files
+    0,  0,  0,  0,  0,  0,  0,  0,
+    0,  0,  0,  0,  0,  0,  0,  0,
+    0,  0,  0,  0,  0,  0,  0,  0,
+    0,  0,  0,  0,  0,  0,  0,  0,
+    0,  0,  0,  5,  5,  0,  0,  0
+]
+
+QUEEN_TABLE = [
+    -20,-10,-10, -5, -5,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5,  5,  5,  5,  0,-10,
+    -5,  0,  5,  5,  5,  5,  0, -5,
+    0,  0,  5,  5,  5,  5,  0, -5,  # Queen more active in center
+    -10,  5,  5,  5,  5,  5,  0,-10,
+    -10,  0,  5,  0,  0,  0,  0,-10,
+    -20,-10,-10, -5, -5,-10,-10,-20
+]
+
+KING_TABLE = [
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -20,-30,-30,-40,-40,-30,-30,-20,
+    -10,-20,-20,-20,-20,-20,-20,-10,
+    20, 20,  0,  0,  0,  0, 20, 20,
+    20, 30, 10,  0,  0, 10, 30, 20
+]
 
 def evaluate_board(board):
     """Enhanced board evaluation with aggressive attacking style"""
@@ -447,73 +912,6 @@ def evaluate_board(board):
         "p": -1, "n": -3, "b": -3, "r": -5, "q": -9, "k": 0,
     }
     
-    # Aggressive piece-square tables for attacking play
-    pawn_table = [
-        0,  0,  0,  0,  0,  0,  0,  0,
-        50, 50, 50, 50, 50, 50, 50, 50,
-        20, 20, 30, 40, 40, 30, 20, 20,  # More aggressive pawn advancement
-        15, 15, 25, 35, 35, 25, 15, 15,
-        10, 10, 20, 30, 30, 20, 10, 10,
-        5,  5, 15, 25, 25, 15,  5,  5,
-        0,  0, 10, 20, 20, 10,  0,  0,
-        0,  0,  0,  0,  0,  0,  0,  0
-    ]
-    
-    knight_table = [
-        -50,-40,-30,-30,-30,-30,-40,-50,
-        -40,-20,  0,  5,  5,  0,-20,-40,  # More aggressive knight positioning
-        -30,  5, 15, 20, 20, 15,  5,-30,
-        -30,  0, 20, 25, 25, 20,  0,-30,
-        -30,  5, 20, 25, 25, 20,  5,-30,
-        -30,  0, 15, 20, 20, 15,  0,-30,
-        -40,-20,  0,  5,  5,  0,-20,-40,
-        -50,-40,-30,-30,-30,-30,-40,-50
-    ]
-    
-    bishop_table = [
-        -20,-10,-10,-10,-10,-10,-10,-20,
-        -10,  5,  0,  0,  0,  0,  5,-10,  # More aggressive bishop positioning
-        -10, 10, 10, 10, 10, 10, 10,-10,
-        -10,  0, 10, 10, 10, 10,  0,-10,
-        -10,  5,  5, 10, 10,  5,  5,-10,
-        -10,  0,  5, 10, 10,  5,  0,-10,
-        -10,  5,  0,  0,  0,  0,  5,-10,
-        -20,-10,-10,-10,-10,-10,-10,-20
-    ]
-    
-    rook_table = [
-        0,  0,  0,  0,  0,  0,  0,  0,
-        5, 10, 10, 10, 10, 10, 10,  5,
-        0,  0,  0,  0,  0,  0,  0,  0,  # Rooks prefer open files
-        0,  0,  0,  0,  0,  0,  0,  0,
-        0,  0,  0,  0,  0,  0,  0,  0,
-        0,  0,  0,  0,  0,  0,  0,  0,
-        0,  0,  0,  0,  0,  0,  0,  0,
-        0,  0,  0,  5,  5,  0,  0,  0
-    ]
-    
-    queen_table = [
-        -20,-10,-10, -5, -5,-10,-10,-20,
-        -10,  0,  0,  0,  0,  0,  0,-10,
-        -10,  0,  5,  5,  5,  5,  0,-10,
-        -5,  0,  5,  5,  5,  5,  0, -5,
-        0,  0,  5,  5,  5,  5,  0, -5,  # Queen more active in center
-        -10,  5,  5,  5,  5,  5,  0,-10,
-        -10,  0,  5,  0,  0,  0,  0,-10,
-        -20,-10,-10, -5, -5,-10,-10,-20
-    ]
-    
-    king_table = [
-        -30,-40,-40,-50,-50,-40,-40,-30,
-        -30,-40,-40,-50,-50,-40,-40,-30,
-        -30,-40,-40,-50,-50,-40,-40,-30,
-        -30,-40,-40,-50,-50,-40,-40,-30,
-        -20,-30,-30,-40,-40,-30,-30,-20,
-        -10,-20,-20,-20,-20,-20,-20,-10,
-        20, 20,  0,  0,  0,  0, 20, 20,
-        20, 30, 10,  0,  0, 10, 30, 20
-    ]
-    
     eval = 0
     for square in chess.SQUARES:
         piece = board.piece_at(square)
@@ -530,17 +928,17 @@ def evaluate_board(board):
                 pos = 63 - square  # Mirror for black
                 
             if piece.piece_type == chess.PAWN:
-                eval += pawn_table[pos] * 0.15  # Increased pawn value
+                eval += PAWN_TABLE[pos] * 0.15  # Increased pawn value
             elif piece.piece_type == chess.KNIGHT:
-                eval += knight_table[pos] * 0.15
+                eval += KNIGHT_TABLE[pos] * 0.15
             elif piece.piece_type == chess.BISHOP:
-                eval += bishop_table[pos] * 0.15
+                eval += BISHOP_TABLE[pos] * 0.15
             elif piece.piece_type == chess.ROOK:
-                eval += rook_table[pos] * 0.15
+                eval += ROOK_TABLE[pos] * 0.15
             elif piece.piece_type == chess.QUEEN:
-                eval += queen_table[pos] * 0.15
+                eval += QUEEN_TABLE[pos] * 0.15
             elif piece.piece_type == chess.KING:
-                eval += king_table[pos] * 0.15
+                eval += KING_TABLE[pos] * 0.15
     
     # Aggressive bonuses for attacking play
     # Bonus for controlling center
@@ -578,6 +976,272 @@ def evaluate_board(board):
     
     return eval
 
+# Pawn structure weights (pawns, from the pawn owner's point of view)
+DOUBLED_PAWN_PENALTY = 0.25
+ISOLATED_PAWN_PENALTY = 0.2
+BACKWARD_PAWN_PENALTY = 0.15
+PASSED_PAWN_BONUS = [0, 0.1, 0.15, 0.25, 0.4, 0.6, 0.9, 0]  # By relative rank
+PAWN_HASH_SIZE = 1 << 14                                       # Entries, power of two
+
+def build_pawn_masks():
+    """Precompute adjacent-file, passed-pawn and support masks for every square"""
+    adjacent_files = []
+    for file in range(8):
+        mask = 0
+        if file > 0:
+            mask |= chess.BB_FILES[file - 1]
+        if file < 7:
+            mask |= chess.BB_FILES[file + 1]
+        adjacent_files.append(mask)
+    
+    passed = {chess.WHITE: [], chess.BLACK: []}
+    support = {chess.WHITE: [], chess.BLACK: []}
+    for square in chess.SQUARES:
+        file = chess.square_file(square)
+        rank = chess.square_rank(square)
+        span = chess.BB_FILES[file] | adjacent_files[file]
+        # Ranks strictly in front of / at-or-behind the pawn, built with shifts
+        ahead_white = (chess.BB_ALL << (8 * (rank + 1))) & chess.BB_ALL
+        ahead_black = chess.BB_ALL >> (8 * (8 - rank))
+        passed[chess.WHITE].append(span & ahead_white)
+        passed[chess.BLACK].append(span & ahead_black)
+        support[chess.WHITE].append(adjacent_files[file] & ~ahead_white & chess.BB_ALL)
+        support[chess.BLACK].append(adjacent_files[file] & ~ahead_black & chess.BB_ALL)
+    return adjacent_files, passed, support
+
+ADJACENT_FILE_MASKS, PASSED_PAWN_MASKS, PAWN_SUPPORT_MASKS = build_pawn_masks()
+
+def pawn_zobrist_key(board):
+    """Zobrist key of the pawns only, using the polyglot random numbers"""
+    key = 0
+    for square in chess.scan_forward(board.pawns & board.occupied_co[chess.WHITE]):
+        key ^= chess.polyglot.POLYGLOT_RANDOM_ARRAY[64 + square]
+    for square in chess.scan_forward(board.pawns & board.occupied_co[chess.BLACK]):
+        key ^= chess.polyglot.POLYGLOT_RANDOM_ARRAY[square]
+    return key
+
+def score_pawn_structure(white_pawns, black_pawns):
+    """Passed, doubled, isolated and backward pawn terms from White's point of view"""
+    score = 0
+    for color, own, enemy in [(chess.WHITE, white_pawns, black_pawns),
+                              (chess.BLACK, black_pawns, white_pawns)]:
+        side_score = 0
+        
+        # Doubled and isolated pawns, one file at a time
+        for file in range(8):
+            on_file = own & chess.BB_FILES[file]
+            if not on_file:
+                continue
+            count = chess.popcount(on_file)
+            if count > 1:
+                side_score -= DOUBLED_PAWN_PENALTY * (count - 1)
+            if not own & ADJACENT_FILE_MASKS[file]:
+                side_score -= ISOLATED_PAWN_PENALTY * count
+        
+        for square in chess.scan_forward(own):
+            # Passed pawn: no enemy pawn in front on this or adjacent files
+            if not enemy & PASSED_PAWN_MASKS[color][square]:
+                rank = chess.square_rank(square)
+                side_score += PASSED_PAWN_BONUS[rank if color else 7 - rank]
+            
+            # Backward pawn: no friendly support and the stop square is guarded by an enemy pawn
+            elif not own & PAWN_SUPPORT_MASKS[color][square]:
+                stop_square = square + 8 if color else square - 8
+                if 0 <= stop_square < 64 and chess.BB_PAWN_ATTACKS[color][stop_square] & enemy:
+                    side_score -= BACKWARD_PAWN_PENALTY
+        
+        score += side_score if color else -side_score
+    return score
+
+class PawnHashTable:
+    """Fixed-size table caching pawn structure scores by pawn-only Zobrist key"""
+    def __init__(self, size=PAWN_HASH_SIZE):
+        self.mask = size - 1
+        self.keys = [None] * size
+        self.scores = [0] * size
+        self.hits = 0
+        self.misses = 0
+    
+    def probe(self, board):
+        key = pawn_zobrist_key(board)
+        index = key & self.mask
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.scores[index]
+        
+        self.misses += 1
+        score = score_pawn_structure(
+            board.pawns & board.occupied_co[chess.WHITE],
+            board.pawns & board.occupied_co[chess.BLACK],
+        )
+        self.keys[index] = key  # Always replace, pawn structures rarely repeat far apart
+        self.scores[index] = score
+        return score
+    
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+PAWN_HASH = PawnHashTable()
+
+def evaluate_pawn_structure(board):
+    """Cached pawn structure score from White's point of view"""
+    return PAWN_HASH.probe(board)
+
+def evaluate_board_advanced(board):
+    """evaluate_board plus pawn structure terms, used by the hard AI"""
+    return evaluate_board(board) + evaluate_pawn_structure(board)
+
+PST_TABLES = {
+    chess.PAWN: PAWN_TABLE, chess.KNIGHT: KNIGHT_TABLE, chess.BISHOP: BISHOP_TABLE,
+    chess.ROOK: ROOK_TABLE, chess.QUEEN: QUEEN_TABLE, chess.KING: KING_TABLE,
+}
+SEARCH_PIECE_VALUES = dict(PLAYOUT_PIECE_VALUES)  # Kings are not counted
+TEMPO_BONUS = 0.3  # Pawns for the side to move, evens out scores after White and Black moves
+
+def evaluate_centered(board):
+    """Search evaluation in pawns from White's point of view
+    
+    Uses the same ideas as evaluate_board, but every term is scored for both
+    sides and Black's is subtracted, so a position and its colour-flipped
+    mirror get opposite scores. The tables are written rank 8 first and are
+    in centipawns. The side to move gets TEMPO_BONUS, otherwise whoever
+    moved last looks better and evals swing back and forth every ply.
+    """
+    kings = {color: board.king(color) for color in chess.COLORS}
+    score = 0.0
+    for square, piece in board.piece_map().items():
+        if piece.color == chess.WHITE:
+            value = PST_TABLES[piece.piece_type][square ^ 56]
+        else:
+            value = PST_TABLES[piece.piece_type][square]
+        value = value / 100 + SEARCH_PIECE_VALUES.get(piece.piece_type, 0)
+        
+        # Pieces close to the enemy king
+        enemy_king = kings[not piece.color]
+        if piece.piece_type != chess.KING and enemy_king is not None:
+            king_distance = abs(square % 8 - enemy_king % 8) + abs(square // 8 - enemy_king // 8)
+            if king_distance <= 4:
+                value += 0.3
+        score += value if piece.color else -value
+    
+    for square in [chess.E4, chess.E5, chess.D4, chess.D5]:
+        piece = board.piece_at(square)
+        if piece:
+            score += 0.4 if piece.color else -0.4
+    
+    # Undeveloped minor pieces
+    for square, piece_type in [(chess.B1, chess.KNIGHT), (chess.G1, chess.KNIGHT),
+                               (chess.B8, chess.KNIGHT), (chess.G8, chess.KNIGHT),
+                               (chess.C1, chess.BISHOP), (chess.F1, chess.BISHOP),
+                               (chess.C8, chess.BISHOP), (chess.F8, chess.BISHOP)]:
+        piece = board.piece_at(square)
+        if piece and piece.piece_type == piece_type:
+            score += -0.5 if piece.color else 0.5
+    
+    score += TEMPO_BONUS if board.turn == chess.WHITE else -TEMPO_BONUS
+    return score + evaluate_pawn_structure(board)
+
+def is_antisymmetric(evaluate, fens=PLAYOUT_BENCH_FENS):
+    """Whether evaluate(b) == -evaluate(b.mirror()), required of a search evaluation"""
+    for fen in fens:
+        board = chess.Board(fen)
+        if abs(evaluate(board) + evaluate(board.mirror())) > EVAL_SYMMETRY_TOLERANCE:
+            return False
+    return True
+
+NNUE_FEATURES = 768                                            # 12 piece planes x 64 squares
+NNUE_PIECE_PLANES = [(color, piece_type) for color in chess.COLORS
+                     for piece_type in chess.PIECE_TYPES]     # White P..K, then Black p..k
+
+class NNUEEvaluator:
+    """Small piece-square network evaluated on the CPU with NumPy
+    
+    The first layer is kept as an accumulator. Each call compares the piece
+    bitboards with the previous position and only adds or subtracts the
+    weight rows of features that changed, which after a push/pop is a handful.
+    """
+    def __init__(self, weights):
+        if np is None:
+            raise ImportError("NumPy is required for the NNUE evaluator")
+        self.w1 = np.asarray(weights["w1"], dtype=np.float64)   # (768, hidden)
+        self.b1 = np.asarray(weights["b1"], dtype=np.float64)   # (hidden,)
+        self.w2 = np.asarray(weights["w2"], dtype=np.float64)   # (hidden, hidden2)
+        self.b2 = np.asarray(weights["b2"], dtype=np.float64)   # (hidden2,)
+        self.w3 = np.asarray(weights["w3"], dtype=np.float64).reshape(-1)  # (hidden2,)
+        self.b3 = float(np.asarray(weights["b3"]).reshape(-1)[0])
+        self.scale = float(weights["scale"]) if "scale" in weights else 1.0
+        
+        hidden = self.b1.shape[0]
+        if (self.w1.shape != (NNUE_FEATURES, hidden) or self.w2.shape[0] != hidden or
+                self.w2.shape[1] != self.b2.shape[0] or self.w3.shape[0] != self.b2.shape[0]):
+            raise ValueError("NNUE weights have inconsistent shapes")
+        
+        self.planes = None
+        self.accumulator = None
+        self.evaluations = 0
+        self.eval_time = 0.0
+    
+    def piece_planes(self, board):
+        """Bitboard of every (color, piece type) feature plane"""
+        return [board.pieces_mask(piece_type, color) for color, piece_type in NNUE_PIECE_PLANES]
+    
+    def update_accumulator(self, board):
+        """Bring the accumulator to this board's position"""
+        planes = self.piece_planes(board)
+        if self.planes is None:
+            features = [plane * 64 + square for plane, mask in enumerate(planes)
+                        for square in chess.scan_forward(mask)]
+            self.accumulator = self.b1 + self.w1[features].sum(axis=0)
+        else:
+            added = []
+            removed = []
+            for plane, (new, old) in enumerate(zip(planes, self.planes)):
+                if new != old:
+                    added.extend(plane * 64 + square for square in chess.scan_forward(new & ~old))
+                    removed.extend(plane * 64 + square for square in chess.scan_forward(old & ~new))
+            for feature in added:
+                self.accumulator += self.w1[feature]
+            for feature in removed:
+                self.accumulator -= self.w1[feature]
+        self.planes = planes
+        return self.accumulator
+    
+    def forward(self, accumulators):
+        """Layers after the accumulator, for one row or a batch of rows"""
+        hidden = np.clip(accumulators, 0.0, 1.0)
+        hidden = np.clip(hidden @ self.w2 + self.b2, 0.0, 1.0)
+        return (hidden @ self.w3 + self.b3) * self.scale
+    
+    def __call__(self, board):
+        """Evaluation from White's point of view, drop-in for evaluate_board"""
+        start_time = time.perf_counter()
+        score = float(self.forward(self.update_accumulator(board)))
+        self.evaluations += 1
+        self.eval_time += time.perf_counter() - start_time
+        return score
+    
+    def evaluate_batch(self, boards):
+        """Evaluate many leaves with a single pass through the dense layers"""
+        start_time = time.perf_counter()
+        accumulators = np.empty((len(boards), self.b1.shape[0]))
+        for i, board in enumerate(boards):
+            accumulators[i] = self.update_accumulator(board)
+        scores = self.forward(accumulators).tolist()
+        self.evaluations += len(boards)
+        self.eval_time += time.perf_counter() - start_time
+        return scores
+    
+    def evals_per_second(self):
+        return self.evaluations / self.eval_time if self.eval_time else 0.0
+
+def load_nnue_weights(path):
+    """Load an NNUEEvaluator from a local .npz file (w1, b1, w2, b2, w3, b3, optional scale)"""
+    if np is None:
+        raise ImportError("NumPy is required for the NNUE evaluator")
+    with np.load(path) as data:
+        return NNUEEvaluator({name: data[name] for name in data.files})
+
 def get_opening_move(board):
     """Simple opening book for better early game play"""
     # Common opening moves
@@ -600,8 +1264,74 @@ def get_opening_move(board):
                 continue
     return None
 
-def get_smart_ai_move(board, game_state):
-    """Enhanced AI move selection with aggressive attacking style"""
+def build_king_zones(radius):
+    """Bitboard of squares within a Manhattan distance of each square"""
+    zones = []
+    for square in chess.SQUARES:
+        mask = 0
+        for other in chess.SQUARES:
+            distance = abs(other % 8 - square % 8) + abs(other // 8 - square // 8)
+            if distance <= radius:
+                mask |= chess.BB_SQUARES[other]
+        zones.append(mask)
+    return zones
+
+KING_ZONE_NEAR = build_king_zones(3)
+KING_ZONE_FAR = build_king_zones(5)
+
+class PositionFeatures:
+    """Position-level data shared by every candidate move in get_smart_ai_move"""
+    def __init__(self, board):
+        us = board.turn
+        them = not us
+        occupied = board.occupied
+        
+        self.own_pawns = board.pawns & board.occupied_co[us]
+        self.minor_pieces = (board.knights | board.bishops) & board.occupied_co[us]
+        self.own_queens = board.queens & board.occupied_co[us]
+        self.enemy_occupied = board.occupied_co[them]
+        self.enemy_count = chess.popcount(self.enemy_occupied)
+        self.occupied = occupied
+        
+        enemy_king = board.king(them)
+        self.enemy_king = enemy_king
+        self.king_zone_near = KING_ZONE_NEAR[enemy_king] if enemy_king is not None else 0
+        self.king_zone_far = KING_ZONE_FAR[enemy_king] if enemy_king is not None else 0
+        
+        # Squares from which each piece type would attack the enemy king
+        self.check_squares = {}
+        self.discovered_check_sources = 0
+        if enemy_king is not None:
+            diagonal = chess.BB_DIAG_ATTACKS[enemy_king][chess.BB_DIAG_MASKS[enemy_king] & occupied]
+            straight = (chess.BB_RANK_ATTACKS[enemy_king][chess.BB_RANK_MASKS[enemy_king] & occupied] |
+                        chess.BB_FILE_ATTACKS[enemy_king][chess.BB_FILE_MASKS[enemy_king] & occupied])
+            self.check_squares = {
+                chess.PAWN: chess.BB_PAWN_ATTACKS[them][enemy_king],
+                chess.KNIGHT: chess.BB_KNIGHT_ATTACKS[enemy_king],
+                chess.BISHOP: diagonal,
+                chess.ROOK: straight,
+                chess.QUEEN: diagonal | straight,
+                chess.KING: 0,
+            }
+            
+            # Our pieces that are the only blocker between one of our sliders and the enemy king
+            snipers = ((chess.BB_RANK_ATTACKS[enemy_king][0] | chess.BB_FILE_ATTACKS[enemy_king][0]) &
+                       (board.rooks | board.queens) & board.occupied_co[us])
+            snipers |= chess.BB_DIAG_ATTACKS[enemy_king][0] & (board.bishops | board.queens) & board.occupied_co[us]
+            for sniper in chess.scan_forward(snipers):
+                blockers = chess.between(enemy_king, sniper) & occupied
+                if blockers and chess.popcount(blockers) == 1 and blockers & board.occupied_co[us]:
+                    self.discovered_check_sources |= blockers
+    
+    def gives_check(self, board, move, piece_type):
+        """Same answer as board.gives_check(move), without pushing ordinary moves"""
+        if (move.promotion or board.is_en_passant(move) or board.is_castling(move) or
+                chess.BB_SQUARES[move.from_square] & self.discovered_check_sources):
+            return board.gives_check(move)
+        return bool(self.check_squares.get(piece_type, 0) & chess.BB_SQUARES[move.to_square])
+
+def score_smart_moves(board, game_state):
+    """Score candidate moves with the aggressive heuristics, best first"""
     legal_moves = list(board.legal_moves)
     
     # Remove recently played moves to prevent repetition
@@ -612,65 +1342,66 @@ def get_smart_ai_move(board, game_state):
     if filtered_moves:
         legal_moves = filtered_moves
     
+    # Extract position-level features once, then score each move against them
+    features = PositionFeatures(board)
+    early_game = len(game_state.move_history) < 10
+    last_from_square = game_state.ai_last_moves[-1].from_square if game_state.ai_last_moves else None
+    # Every enemy piece not on the target square is worth the discovered attack bonus
+    enemy_piece_bonus = 0.2 * features.enemy_count
+    
     # Score all moves
     move_scores = []
     for move in legal_moves:
         score = 0
+        from_bb = chess.BB_SQUARES[move.from_square]
+        to_bb = chess.BB_SQUARES[move.to_square]
+        piece_type = board.piece_type_at(move.from_square)
+        gives_check = features.gives_check(board, move, piece_type)
         
-        # Basic evaluation
+        # Basic evaluation (with cached pawn structure terms), plus mate detection
+        # while the move is on the board
         board.push(move)
-        score += evaluate_board(board)
+        score += game_state.evaluate(board)
+        is_mate = gives_check and board.is_checkmate()
         board.pop()
         
         # Aggressive bonuses for attacking play
         
         # Bonus for captures (increased for aggressive play)
-        if board.piece_at(move.to_square):
+        if to_bb & features.occupied:
             score += 1.0  # Increased capture bonus
         
         # Bonus for center control (increased)
-        if move.to_square in [chess.E4, chess.E5, chess.D4, chess.D5]:
+        if to_bb & chess.BB_CENTER:
             score += 0.6  # Increased center control bonus
         
         # Bonus for developing pieces early (increased)
-        if len(game_state.move_history) < 10:
-            piece = board.piece_at(move.from_square)
-            if piece and piece.piece_type in [chess.KNIGHT, chess.BISHOP]:
-                score += 0.4  # Increased development bonus
+        if early_game and from_bb & features.minor_pieces:
+            score += 0.4  # Increased development bonus
         
         # Bonus for castling (reduced for aggressive play)
         if board.is_castling(move):
             score += 0.2  # Reduced castling bonus for more aggressive play
         
         # Bonus for check (increased for aggressive play)
-        if board.gives_check(move):
+        if gives_check:
             score += 0.8  # Increased check bonus
         
         # Bonus for attacking squares near enemy king (increased)
-        enemy_king = board.king(not board.turn)
-        if enemy_king is not None:
-            king_distance = abs(move.to_square % 8 - enemy_king % 8) + abs(move.to_square // 8 - enemy_king // 8)
-            if king_distance <= 3:
-                score += 0.6  # Increased king attack bonus
-            elif king_distance <= 5:
-                score += 0.3  # Medium distance attack bonus
-        
-        # Bonus for attacking moves (new aggressive feature)
-        # Check if move attacks enemy pieces
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if piece and piece.color != board.turn:  # Enemy piece
-                # Check if our move attacks this piece
-                if move.to_square == square:
-                    score += 0.5  # Direct attack bonus
-                # Check if move creates discovered attacks
-                elif move.from_square != square:
-                    # Simple discovered attack detection
-                    score += 0.2  # Discovered attack bonus
+        if to_bb & features.king_zone_near:
+            score += 0.6  # Increased king attack bonus
+        elif to_bb & features.king_zone_far:
+            score += 0.3  # Medium distance attack bonus
+        
+        # Bonus for attacking moves: direct attack on the target square,
+        # discovered attack bonus for every other enemy piece
+        if to_bb & features.enemy_occupied:
+            score += enemy_piece_bonus + 0.3
+        else:
+            score += enemy_piece_bonus
         
         # Bonus for pawn advancement (aggressive)
-        piece = board.piece_at(move.from_square)
-        if piece and piece.piece_type == chess.PAWN:
+        if from_bb & features.own_pawns:
             if board.turn:  # White pawns
                 if move.to_square // 8 > move.from_square // 8:  # Moving forward
                     score += 0.3
@@ -679,27 +1410,153 @@ def get_smart_ai_move(board, game_state):
                     score += 0.3
         
         # Bonus for queen activity (aggressive)
-        if piece and piece.piece_type == chess.QUEEN:
+        if from_bb & features.own_queens:
             score += 0.4  # Queen activity bonus
         
         # Penalty for moving the same piece repeatedly (reduced for aggressive play)
-        if game_state.ai_last_moves and move.from_square == game_state.ai_last_moves[-1].from_square:
+        if move.from_square == last_from_square:
             score -= 0.1  # Reduced penalty for aggressive play
         
         # Bonus for tactical opportunities
-        if board.gives_check(move):
+        if gives_check:
             # Check if check leads to mate or winning position
-            board.push(move)
-            if board.is_checkmate():
+            if is_mate:
                 score += 10.0  # Mate bonus
-            elif board.is_check():
+            else:
                 score += 0.5  # Double check bonus
-            board.pop()
         
         move_scores.append((move, score))
     
-    # Sort by score and add some randomness to top moves
     move_scores.sort(key=lambda x: x[1], reverse=True)
+    return move_scores
+
+class ExperienceStore:
+    """Opening tree learned from played games, persisted in SQLite and keyed by Zobrist hash"""
+    def __init__(self, path=EXPERIENCE_PATH):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS experience ("
+            " position INTEGER NOT NULL, move TEXT NOT NULL,"
+            " visits INTEGER NOT NULL, white_wins INTEGER NOT NULL,"
+            " black_wins INTEGER NOT NULL, draws INTEGER NOT NULL,"
+            " score_sum REAL NOT NULL, score_count INTEGER NOT NULL,"
+            " PRIMARY KEY (position, move))"
+        )
+        self.connection.commit()
+        self.buffer = {}  # (position, move) -> [visits, white wins, black wins, draws, score sum, score count]
+    
+    def position_key(self, board):
+        """Zobrist hash as a signed 64-bit SQLite integer"""
+        key = chess.polyglot.zobrist_hash(board)
+        return key - (1 << 64) if key >= 1 << 63 else key
+    
+    def record_game(self, start_board, moves, result, scores=None):
+        """Buffer the opening moves of one game with its result and any search scores (by ply)"""
+        scores = scores or {}
+        board = start_board.copy(stack=False)
+        outcome = {"1-0": (1, 0, 0), "0-1": (0, 1, 0), "1/2-1/2": (0, 0, 1)}.get(result, (0, 0, 0))
+        for ply, move in enumerate(moves):
+            if ply >= EXPERIENCE_MAX_PLY:
+                break
+            entry = self.buffer.setdefault((self.position_key(board), move.uci()), [0, 0, 0, 0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += outcome[0]
+            entry[2] += outcome[1]
+            entry[3] += outcome[2]
+            if ply in scores:
+                entry[4] += scores[ply]
+                entry[5] += 1
+            board.push(move)
+        
+        if len(self.buffer) >= EXPERIENCE_BATCH_SIZE:
+            self.flush()
+    
+    def flush(self):
+        """Write buffered moves in one transaction, then prune if the store is too big"""
+        if not self.buffer:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO experience VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (position, move) DO UPDATE SET"
+                " visits = visits + excluded.visits,"
+                " white_wins = white_wins + excluded.white_wins,"
+                " black_wins = black_wins + excluded.black_wins,"
+                " draws = draws + excluded.draws,"
+                " score_sum = score_sum + excluded.score_sum,"
+                " score_count = score_count + excluded.score_count",
+                [(position, move, *entry) for (position, move), entry in self.buffer.items()],
+            )
+        self.buffer = {}
+        self.prune()
+    
+    def prune(self, max_entries=EXPERIENCE_MAX_ENTRIES):
+        """Drop the least visited moves once the store grows past max_entries"""
+        count = self.connection.execute("SELECT COUNT(*) FROM experience").fetchone()[0]
+        if count <= max_entries:
+            return 0
+        excess = count - int(max_entries * EXPERIENCE_PRUNE_TO)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM experience WHERE rowid IN "
+                "(SELECT rowid FROM experience ORDER BY visits ASC LIMIT ?)", (excess,)
+            )
+        return excess
+    
+    def probe(self, board):
+        """Best known move for this position, or None if experience is too thin"""
+        rows = self.connection.execute(
+            "SELECT move, visits, white_wins, black_wins, draws, score_sum, score_count "
+            "FROM experience WHERE position = ?", (self.position_key(board),)
+        ).fetchall()
+        
+        sign = 1 if board.turn == chess.WHITE else -1
+        best = None
+        for uci, visits, white_wins, black_wins, draws, score_sum, score_count in rows:
+            decided = white_wins + black_wins + draws
+            if visits < EXPERIENCE_MIN_VISITS or not decided:
+                continue
+            wins = white_wins if board.turn == chess.WHITE else black_wins
+            expectation = (wins + 0.5 * draws) / decided
+            search_score = sign * score_sum / score_count if score_count else 0.0
+            candidate = (expectation, search_score, visits, uci)
+            if best is None or candidate > best:
+                best = candidate
+        
+        if best is None or best[0] < EXPERIENCE_MIN_EXPECTATION:
+            return None
+        move = chess.Move.from_uci(best[3])
+        return move if move in board.legal_moves else None
+    
+    def import_pgn(self, path):
+        """Bulk-import games from a PGN file, streaming one game at a time"""
+        games = 0
+        with open(path, encoding="utf-8-sig", errors="replace") as pgn_file:
+            while True:
+                game = chess.pgn.read_game(pgn_file)
+                if game is None:
+                    break
+                self.record_game(game.board(), list(game.mainline_moves()), game.headers.get("Result", "*"))
+                games += 1
+        self.flush()
+        return games
+    
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+def game_result(game_state):
+    """PGN result string for a finished game"""
+    if game_state.winner == "White":
+        return "1-0"
+    if game_state.winner == "Black":
+        return "0-1"
+    return "1/2-1/2" if game_state.game_over else "*"
+
+def get_smart_ai_move(board, game_state):
+    """Enhanced AI move selection with aggressive attacking style"""
+    # Sort by score and add some randomness to top moves
+    move_scores = score_smart_moves(board, game_state)
     
     # Select from top 3 moves with some randomness (more aggressive selection)
     top_moves = move_scores[:min(3, len(move_scores))]
@@ -715,32 +1572,472 @@ def get_smart_ai_move(board, game_state):
             if rand <= cumulative_weight:
                 return move
     
-    return move_scores[0][0] if move_scores else random.choice(legal_moves)
+    return move_scores[0][0] if move_scores else random.choice(list(board.legal_moves))
+
+class SearchTimeout(Exception):
+    """Raised inside search_position when the hard time limit is reached"""
+
+def capture_value(board, move):
+    """Most valuable victim, then least valuable attacker, for ordering captures"""
+    victim = board.piece_type_at(move.to_square) or chess.PAWN  # En passant
+    attacker = board.piece_type_at(move.from_square)
+    return SEARCH_PIECE_VALUES.get(victim, 0) * 10 - SEARCH_PIECE_VALUES.get(attacker, 10)
+
+def quiescence(board, alpha, beta, evaluate, deadline=None, plies=QUIESCENCE_MAX_PLIES):
+    """Captures-only search below the horizon, score from White's point of view"""
+    if deadline is not None and time.time() > deadline:
+        raise SearchTimeout()
+    
+    # The side to move may also stop capturing
+    best_score = evaluate(board)
+    if board.turn == chess.WHITE:
+        alpha = max(alpha, best_score)
+    else:
+        beta = min(beta, best_score)
+    if alpha >= beta or plies <= 0:
+        return best_score
+    
+    captures = sorted(board.generate_legal_captures(),
+                      key=lambda move: capture_value(board, move), reverse=True)
+    for move in captures:
+        board.push(move)
+        score = quiescence(board, alpha, beta, evaluate, deadline, plies - 1)
+        board.pop()
+        if board.turn == chess.WHITE:
+            best_score = max(best_score, score)
+            alpha = max(alpha, score)
+        else:
+            best_score = min(best_score, score)
+            beta = min(beta, score)
+        if alpha >= beta:
+            break
+    return best_score
+
+def mate_in(score, depth):
+    """Moves to mate from the root of a depth-limited search, None if not a mate score"""
+    if abs(score) < MATE_SCORE:
+        return None
+    plies = depth - (abs(score) - MATE_SCORE)
+    return (plies + 1) // 2
+
+def format_eval(score, depth):
+    """Score in pawns, or #N / #-N when White / Black mates in N"""
+    moves = mate_in(score, depth)
+    if moves is None:
+        return f"{round(score, 2) + 0.0:.2f}"  # No "-0.00"
+    return f"#{moves}" if score > 0 else f"#-{moves}"
+
+def search_position(board, depth, alpha=float('-inf'), beta=float('inf'), evaluate=None, deadline=None):
+    """Fixed-depth alpha-beta search, score from White's point of view"""
+    if evaluate is None:
+        evaluate = evaluate_centered
+    if deadline is not None and time.time() > deadline:
+        raise SearchTimeout()
+    
+    if board.is_checkmate():
+        # Remaining depth is added so that quicker mates score higher
+        mate_score = MATE_SCORE + max(depth, 0)
+        return -mate_score if board.turn == chess.WHITE else mate_score
+    if board.is_stalemate() or board.is_insufficient_material():
+        return 0
+    if depth <= 0:
+        return quiescence(board, alpha, beta, evaluate, deadline)
+    
+    if board.turn == chess.WHITE:
+        best_score = float('-inf')
+        for move in board.legal_moves:
+            board.push(move)
+            score = search_position(board, depth - 1, alpha, beta, evaluate, deadline)
+            board.pop()
+            best_score = max(best_score, score)
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+    else:
+        best_score = float('inf')
+        for move in board.legal_moves:
+            board.push(move)
+            score = search_position(board, depth - 1, alpha, beta, evaluate, deadline)
+            board.pop()
+            best_score = min(best_score, score)
+            beta = min(beta, score)
+            if alpha >= beta:
+                break
+    return best_score
+
+def score_root_moves(board, depth, evaluate=None):
+    """Score every legal move with a search of depth - 1 below it"""
+    scores = {}
+    if depth == 1 and isinstance(evaluate, NNUEEvaluator):
+        # Leaves directly below the root go through the network as one batch
+        leaves = []
+        for move in board.legal_moves:
+            board.push(move)
+            if board.is_checkmate() or board.is_stalemate() or board.is_insufficient_material():
+                scores[move] = search_position(board, 0)
+            else:
+                leaves.append((move, board.copy(stack=False)))
+            board.pop()
+        if leaves:
+            for (move, leaf), score in zip(leaves, evaluate.evaluate_batch([leaf for move, leaf in leaves])):
+                scores[move] = score
+        return scores
+    
+    for move in board.legal_moves:
+        board.push(move)
+        scores[move] = search_position(board, depth - 1, evaluate=evaluate)
+        board.pop()
+    return scores
+
+def get_timed_ai_move(board, game_state):
+    """Hard AI under the clock: iterative deepening with an adaptive time budget"""
+    legal_move_count = board.legal_moves.count()
+    time_manager = TimeManager(
+        remaining_time(game_state, board.turn),
+        game_state.increment,
+        board.fullmove_number,
+        legal_move_count,
+    )
+    
+    # First iteration: the aggressive heuristics, which also order the deeper searches
+    move_scores = score_smart_moves(board, game_state)
+    order = [move for move, score in move_scores]
+    best_move = order[0]
+    time_manager.record_iteration(best_move)
+    if legal_move_count <= 1:
+        return best_move
+    
+    sign = 1 if board.turn == chess.WHITE else -1
+    deadline = time_manager.deadline()
+    ply = len(board.move_stack)
+    best_score = None
+    depth = 1
+    while time_manager.should_start_iteration():
+        scores = {}
+        try:
+            for move in order:
+                board.push(move)
+                scores[move] = sign * search_position(
+                    board, depth - 1, evaluate=game_state.search_evaluate, deadline=deadline
+                )
+                board.pop()
+        except SearchTimeout:
+            # Unwind the interrupted search. Moves are searched previous best first,
+            # so a finished move that beats it at the new depth is still trustworthy
+            while len(board.move_stack) > ply:
+                board.pop()
+            if scores:
+                best_move = max(scores, key=scores.get)
+                best_score = scores[best_move]
+            break
+        
+        order.sort(key=lambda m: scores[m], reverse=True)
+        best_move = order[0]
+        best_score = scores[best_move]
+        margin = scores[order[0]] - scores[order[1]] if len(order) > 1 else None
+        time_manager.record_iteration(best_move, margin)
+        if abs(scores[best_move]) >= MATE_SCORE:
+            break
+        depth += 1
+    
+    print(f"AI thought {time_manager.elapsed():.2f}s (budget {time_manager.soft_limit:.2f}s, "
+          f"hard {time_manager.hard_limit:.2f}s), {time_manager.iterations} iterations")
+    if best_score is not None:
+        game_state.search_scores[ply] = sign * best_score
+    return best_move
+
+def init_ai_worker():
+    """Ctrl+C is handled by the game window, not the AI worker"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # SDL's handler is inherited through fork
+
+def search_ai_move(game_state):
+    """get_timed_ai_move on a copy of the game (runs in the AI worker process)
+    
+    Returns the move and the search score the copy recorded for it, if any.
+    """
+    board = game_state.board
+    move = get_timed_ai_move(board, game_state)
+    if isinstance(game_state.search_evaluate, NNUEEvaluator):
+        print(f"NNUE: {game_state.search_evaluate.evals_per_second():.0f} evals/s "
+              f"({game_state.search_evaluate.evaluations} evaluations)")
+    else:
+        print(f"Pawn hash: {PAWN_HASH.hit_rate():.1%} hit rate "
+              f"({PAWN_HASH.hits} hits, {PAWN_HASH.misses} misses)")
+    return move, game_state.search_scores.get(len(board.move_stack))
+
+NNUE_EVALUATORS = {}  # Weights loaded in this process, by path
+
+def get_search_evaluate(nnue_path=None):
+    """Search evaluation for a worker process: cached NNUE weights or evaluate_centered"""
+    if not nnue_path:
+        return evaluate_centered
+    if nnue_path not in NNUE_EVALUATORS:
+        NNUE_EVALUATORS[nnue_path] = load_nnue_weights(nnue_path)
+    return NNUE_EVALUATORS[nnue_path]
+
+def analyze_pgn_game(pgn_text, depth, nnue_path=None):
+    """Annotate one game with evals and mistake/blunder flags (runs in a worker process)"""
+    game = chess.pgn.read_game(io.StringIO(pgn_text))
+    board = game.board()
+    depth = max(1, depth)
+    evaluate = get_search_evaluate(nnue_path)
+    
+    positions = 0
+    for node in game.mainline():
+        # Compare the played move with the best sibling so that every score
+        # has the same side to move and the same search horizon
+        scores = score_root_moves(board, depth, evaluate)
+        positions += 1
+        if node.move not in scores:
+            break  # Illegal move in the source PGN
+        
+        played = scores[node.move]
+        best = max(scores.values()) if board.turn == chess.WHITE else min(scores.values())
+        if mate_in(played, depth) is not None and (played > 0) == (best > 0):
+            loss = 0  # A slower mate, or a loss that was forced anyway
+        elif board.turn == chess.WHITE:
+            loss = best - played
+        else:
+            loss = played - best
+        
+        # A shallow search misses the point of most sacrifices, so it never says "??"
+        if loss >= BLUNDER_THRESHOLD and depth >= BLUNDER_MIN_DEPTH:
+            node.nags.add(chess.pgn.NAG_BLUNDER)
+        elif loss >= MISTAKE_THRESHOLD:
+            node.nags.add(chess.pgn.NAG_MISTAKE)
+        
+        eval_comment = f"[%eval {format_eval(played, depth)}]"
+        node.comment = f"{eval_comment} {node.comment}" if node.comment else eval_comment
+        board.push(node.move)
+    
+    return str(game), positions
+
+def analyze_position(fen, depth, nnue_path=None):
+    """Score and best move for one position (runs in the background worker)"""
+    board = chess.Board(fen)
+    evaluate = get_search_evaluate(nnue_path)
+    if board.is_game_over():
+        return search_position(board, depth, evaluate=evaluate), None
+    scores = score_root_moves(board, depth, evaluate)
+    pick = max if board.turn == chess.WHITE else min
+    best_move = pick(scores, key=scores.get)
+    return scores[best_move], best_move.uci()
+
+def init_background_worker():
+    """Run GUI analysis below the priority of the game itself"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # SDL's handler is inherited through fork
+    if hasattr(os, "nice"):
+        os.nice(ANALYSIS_GUI_NICENESS)
+
+class BackgroundAnalyzer:
+    """Evaluates every position of the current game in a low-priority worker process"""
+    def __init__(self, depth=ANALYSIS_GUI_DEPTH, nnue_path=None):
+        self.depth = depth
+        self.nnue_path = nnue_path  # Loaded again inside the worker
+        self.enabled = False
+        self.executor = None
+        self.results = {}      # Zobrist key -> (score, best move UCI), kept across undo
+        self.pending = {}      # Zobrist key -> future
+        self.game_keys = []    # Key of every position of the current game
+        self.game_state_id = None
+        self.version = 0       # Bumped whenever something drawn from the results changes
+        self.graph_surface = None
+        self.graph_key = None
+        self.arrow_surface = None
+        self.arrow_key = None
+    
+    def toggle(self):
+        self.enabled = not self.enabled
+        if self.enabled and self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=1, initializer=init_background_worker)
+        self.game_state_id = None  # Resync on the next frame
+        self.version += 1
+    
+    def sync(self, board):
+        """Queue any positions of the game that have not been analyzed yet"""
+        state_id = (id(board), len(board.move_stack), board.move_stack[-1] if board.move_stack else None)
+        if state_id == self.game_state_id:
+            return
+        self.game_state_id = state_id
+        
+        # Replay the game once to key every position
+        replay = board.root()
+        positions = [(chess.polyglot.zobrist_hash(replay), replay.fen())]
+        for move in board.move_stack:
+            replay.push(move)
+            positions.append((chess.polyglot.zobrist_hash(replay), replay.fen()))
+        self.game_keys = [key for key, fen in positions]
+        self.version += 1
+        
+        # Drop work for positions that were undone or belong to a previous game,
+        # the single worker would otherwise get to them before the current one
+        live_keys = set(self.game_keys)
+        for key in [key for key in self.pending if key not in live_keys]:
+            self.pending.pop(key).cancel()
+        
+        # Current position first, then the rest of the game from the end
+        for key, fen in reversed(positions):
+            if key not in self.results and key not in self.pending:
+                self.pending[key] = self.executor.submit(analyze_position, fen, self.depth, self.nnue_path)
+    
+    def poll(self):
+        """Collect finished results; True if there is something new to draw"""
+        finished = [key for key, future in self.pending.items() if future.done()]
+        for key in finished:
+            future = self.pending.pop(key)
+            if not future.cancelled() and future.exception() is None:
+                self.results[key] = future.result()
+        if finished:
+            self.version += 1
+        return bool(finished)
+    
+    def current(self):
+        """(score, best move UCI) for the position on the board, if analyzed"""
+        return self.results.get(self.game_keys[-1]) if self.game_keys else None
+    
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
 
-def main():
+def load_analysis_progress(progress_path):
+    """Read resume state written by run_batch_analysis"""
+    if not os.path.exists(progress_path):
+        return {"games": 0, "input_offset": 0, "output_offset": 0}
+    with open(progress_path) as f:
+        return json.load(f)
+
+def save_analysis_progress(progress_path, progress):
+    """Write resume state atomically so an interrupt never leaves it half-written"""
+    tmp_path = progress_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+def init_analysis_worker():
+    """Let only the parent process handle Ctrl+C"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def run_batch_analysis(input_path, output_path, depth=1, workers=None, resume=False, nnue_path=None):
+    """Stream games from a PGN file, analyze them on all cores and write annotated PGN"""
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2  # Bound memory use for arbitrarily large files
+    progress_path = output_path + ".progress"
+    if nnue_path and not is_antisymmetric(get_search_evaluate(nnue_path)):
+        print("Evaluation is not antisymmetric, analyzing with evaluate_centered")
+        nnue_path = None
+    
+    progress = load_analysis_progress(progress_path) if resume else {"games": 0, "input_offset": 0, "output_offset": 0}
+    if progress["games"]:
+        print(f"Resuming after {progress['games']} games")
+    
+    start_time = time.time()
+    games_done = 0
+    positions_done = 0
+    
+    def report():
+        elapsed = max(time.time() - start_time, 1e-9)
+        print(f"Analyzed {games_done} games, {positions_done} positions "
+              f"({games_done / elapsed:.2f} games/s, {positions_done / elapsed:.1f} positions/s)")
+    
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_analysis_worker)
+    try:
+        with open(input_path, encoding="utf-8-sig", errors="replace") as pgn_file, \
+                open(output_path, "a+", encoding="utf-8") as out_file:
+            # Drop anything written after the last recorded checkpoint
+            out_file.truncate(progress["output_offset"])
+            out_file.seek(progress["output_offset"])
+            pgn_file.seek(progress["input_offset"])
+            
+            pending = deque()  # (future, input offset after this game), in file order
+            exhausted = False
+            while pending or not exhausted:
+                # Keep the pool busy without reading the whole file
+                while not exhausted and len(pending) < max_in_flight:
+                    game = chess.pgn.read_game(pgn_file)
+                    if game is None:
+                        exhausted = True
+                        break
+                    future = executor.submit(analyze_pgn_game, str(game), depth, nnue_path)
+                    pending.append((future, pgn_file.tell()))
+                
+                if not pending:
+                    break
+                
+                # Write results in input order so the checkpoint is a simple prefix
+                future, input_offset = pending.popleft()
+                annotated, positions = future.result()
+                out_file.write(annotated + "\n\n")
+                out_file.flush()
+                
+                games_done += 1
+                positions_done += positions
+                progress = {
+                    "games": progress["games"] + 1,
+                    "input_offset": input_offset,
+                    "output_offset": out_file.tell(),
+                }
+                save_analysis_progress(progress_path, progress)
+                
+                if games_done % ANALYSIS_REPORT_EVERY == 0:
+                    report()
+    except KeyboardInterrupt:
+        print(f"Interrupted after {progress['games']} games, rerun with --resume to continue")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    report()
+    return games_done, positions_done
+
+def main(nnue_path=None, experience_path=EXPERIENCE_PATH):
     """Enhanced main game loop"""
+    evaluate = load_nnue_weights(nnue_path) if nnue_path else None
+    search_evaluate = evaluate_centered
+    if evaluate:
+        if is_antisymmetric(evaluate):
+            search_evaluate = evaluate
+        else:
+            print("Evaluation is not antisymmetric, searching with evaluate_centered")
+            nnue_path = None  # Analysis uses the same search evaluation
+    
     welcome_menu()
     difficulty = level_selection_menu()
     
     game_state = GameState()
     game_state.difficulty = difficulty
+    if evaluate:
+        game_state.evaluate = evaluate
+    game_state.search_evaluate = search_evaluate
     buttons = create_buttons()
+    analyzer = BackgroundAnalyzer(nnue_path=nnue_path)
+    ai_executor = ProcessPoolExecutor(max_workers=1, initializer=init_ai_worker)
+    ai_search = None  # (future, move stack searched) while the hard AI is thinking
+    experience = ExperienceStore(experience_path)
     
     clock = pygame.time.Clock()
     running = True
     
     print(f"Game started with difficulty: {difficulty}")
+    print(f"Piece atlas loaded in {ASSETS.load_time * 1000:.1f} ms")
     
     while running:
         # Update animation time
         if game_state.animation_time < game_state.animation_duration:
             game_state.animation_time += clock.get_time() / 1000.0
         
+        # Background analysis (press 'A' to toggle)
+        if analyzer.enabled:
+            analyzer.sync(game_state.board)
+            analyzer.poll()
+        
         # Draw everything
         draw_board()
         highlight_squares(game_state.board, game_state)
         draw_pieces(game_state.board, game_state)
-        draw_panel(game_state)
+        if analyzer.enabled:
+            draw_best_move_arrow(analyzer)
+        draw_panel(game_state, analyzer)
         
         # Draw buttons
         for button in buttons:
@@ -752,6 +2049,12 @@ def main():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.VIDEORESIZE:
+                resize_window(event.w, event.h)
+                buttons = create_buttons()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_a:
+                analyzer.toggle()
+                print(f"Analysis {'on' if analyzer.enabled else 'off'}")
             
             # Handle button events first
             button_clicked = False
@@ -762,6 +2065,9 @@ def main():
                     if button.text == "New Game":
                         game_state = GameState()
                         game_state.difficulty = difficulty
+                        if evaluate:
+                            game_state.evaluate = evaluate
+                        game_state.search_evaluate = search_evaluate
                         game_state.animation_time = 0
                         print("New game started")
                     elif button.text == "Reset":
@@ -774,6 +2080,10 @@ def main():
                         game_state.current_player = "White"
                         game_state.last_move = None
                         game_state.animation_time = 0
+                        game_state.clock = {chess.WHITE: TIME_CONTROL_BASE, chess.BLACK: TIME_CONTROL_BASE}
+                        game_state.turn_start = time.time()
+                        game_state.search_scores = {}
+                        game_state.recorded = False
                         print("Game reset")
                     elif button.text == "Undo":
                         if len(game_state.move_history) > 0:
@@ -783,13 +2093,20 @@ def main():
                             game_state.board = chess.Board()
                             for move_obj, san_move in game_state.move_history:
                                 game_state.board.push(move_obj)
+                            # Scores of undone moves must not be recorded with the replacement moves
+                            ply_count = len(game_state.move_history)
+                            game_state.search_scores = {ply: score for ply, score in game_state.search_scores.items()
+                                                        if ply < ply_count}
                             game_state.current_player = "White" if game_state.board.turn == chess.WHITE else "Black"
                             game_state.last_move = None
                             game_state.animation_time = 0
+                            game_state.turn_start = time.time()
                             print("Move undone")
                     elif button.text == "Settings":
-                        # Show difficulty selection again
+                        # Show difficulty selection again (clocks are paused meanwhile)
+                        paused_at = time.time()
                         new_difficulty = level_selection_menu()
+                        game_state.turn_start += time.time() - paused_at
                         game_state.difficulty = new_difficulty
                         print(f"Difficulty changed to: {new_difficulty}")
                     break  # Only handle one button click at a time
@@ -803,6 +2120,7 @@ def main():
                     )
                     
                     if move_done and move and san_move:
+                        press_clock(game_state, chess.WHITE)
                         game_state.move_history.append((move, san_move))
                         game_state.last_move = move
                         game_state.animation_time = 0
@@ -813,59 +2131,164 @@ def main():
         
         # AI move
         if game_state.board.turn == chess.BLACK and not game_state.game_over:
-            pygame.time.wait(500)  # Small delay for better UX
-            
-            if game_state.difficulty == "easy":
-                move = random.choice(list(game_state.board.legal_moves))
-            elif game_state.difficulty == "medium":
-                # Simple evaluation-based move
-                best_move = None
-                best_score = float('-inf')
-                for move in game_state.board.legal_moves:
-                    game_state.board.push(move)
-                    score = evaluate_board(game_state.board)
-                    game_state.board.pop()
-                    if score > best_score:
-                        best_score = score
-                        best_move = move
-                move = best_move or random.choice(list(game_state.board.legal_moves))
-            elif game_state.difficulty == "hard":
-                # Enhanced AI with smart move selection and anti-repetition
-                # Try opening book first for early game
-                if len(game_state.move_history) < 6:
-                    opening_move = get_opening_move(game_state.board)
-                    if opening_move:
-                        move = opening_move
-                    else:
-                        move = get_smart_ai_move(game_state.board, game_state)
-                else:
-                    move = get_smart_ai_move(game_state.board, game_state)
+            move = None
+            if ai_search is not None:
+                # The hard AI searches in the worker, pick up its move once it is done
+                future, search_moves = ai_search
+                if future.done():
+                    ai_search = None
+                    if search_moves == game_state.board.move_stack:  # Not undone or reset meanwhile
+                        move, score = future.result()
+                        if score is not None:
+                            game_state.search_scores[len(search_moves)] = score
+            else:
+                if remaining_time(game_state, chess.BLACK) > CLOCK_LOW_TIME:
+                    pygame.time.wait(500)  # Small delay for better UX
                 
-                # Track AI moves to prevent repetition
-                game_state.ai_last_moves.append(move)
-                if len(game_state.ai_last_moves) > 6:  # Keep only last 6 moves
-                    game_state.ai_last_moves.pop(0)
+                if game_state.difficulty == "easy":
+                    move = random.choice(list(game_state.board.legal_moves))
+                elif game_state.difficulty == "medium":
+                    # Simple evaluation-based move
+                    best_move = None
+                    best_score = float('-inf')
+                    for move in game_state.board.legal_moves:
+                        game_state.board.push(move)
+                        score = evaluate_board(game_state.board)
+                        game_state.board.pop()
+                        if score > best_score:
+                            best_score = score
+                            best_move = move
+                    move = best_move or random.choice(list(game_state.board.legal_moves))
+                elif game_state.difficulty == "hard":
+                    # Enhanced AI with smart move selection and anti-repetition
+                    # Try opening book first for early game
+                    # then learned experience, and only search when neither knows the position
+                    if len(game_state.move_history) < 6:
+                        move = get_opening_move(game_state.board)
+                    if move is None:
+                        move = experience.probe(game_state.board)
+                        if move is not None:
+                            print("Experience move")
+                    if move is None:
+                        # Search in the worker so the window and clocks keep running
+                        future = ai_executor.submit(search_ai_move, game_state)
+                        ai_search = (future, list(game_state.board.move_stack))
             
-            # Get the SAN notation before pushing the move
-            san_move = game_state.board.san(move)
-            game_state.board.push(move)
-            game_state.move_history.append((move, san_move))
-            game_state.last_move = move
-            game_state.animation_time = 0
-            game_state.current_player = "White"
-            print(f"AI move: {san_move}")
+            if move is not None:
+                if game_state.difficulty == "hard":
+                    # Track AI moves to prevent repetition
+                    game_state.ai_last_moves.append(move)
+                    if len(game_state.ai_last_moves) > 6:  # Keep only last 6 moves
+                        game_state.ai_last_moves.pop(0)
+                
+                # Get the SAN notation before pushing the move
+                san_move = game_state.board.san(move)
+                game_state.board.push(move)
+                press_clock(game_state, chess.BLACK)
+                game_state.move_history.append((move, san_move))
+                game_state.last_move = move
+                game_state.animation_time = 0
+                game_state.current_player = "White"
+                print(f"AI move: {san_move}")
         
         # Check game state
-        if game_state.board.is_game_over():
+        if not game_state.game_over and remaining_time(game_state, game_state.board.turn) <= 0:
+            game_state.clock[game_state.board.turn] = 0
+            game_state.game_over = True
+            game_state.winner = "Black" if game_state.board.turn == chess.WHITE else "White"
+            print(f"{'White' if game_state.board.turn == chess.WHITE else 'Black'} lost on time")
+        elif game_state.board.is_game_over():
             game_state.game_over = True
             if game_state.board.is_checkmate():
                 game_state.winner = "Black" if game_state.board.turn == chess.WHITE else "White"
             elif game_state.board.is_stalemate():
                 game_state.winner = "Draw"
         
+        # Learn from every finished game
+        if game_state.game_over and not game_state.recorded:
+            experience.record_game(chess.Board(), game_state.board.move_stack,
+                                   game_result(game_state), game_state.search_scores)
+            experience.flush()
+            game_state.recorded = True
+        
         clock.tick(60)
     
+    experience.close()
+    analyzer.shutdown()
+    # Don't wait for a search to use up its time budget
+    for process in multiprocessing.active_children():
+        process.terminate()
+    ai_executor.shutdown(wait=False, cancel_futures=True)
     pygame.quit()
 
+def run_self_play(games, experience):
+    """Hard AI against itself, recording every game into the experience store"""
+    for game_number in range(1, games + 1):
+        game_state = GameState()
+        game_state.difficulty = "hard"
+        game_state.clock = {chess.WHITE: SELF_PLAY_BASE, chess.BLACK: SELF_PLAY_BASE}
+        game_state.increment = SELF_PLAY_INCREMENT
+        board = game_state.board
+        
+        while not board.is_game_over(claim_draw=True) and len(board.move_stack) < SELF_PLAY_MAX_PLIES:
+            if remaining_time(game_state, board.turn) <= 0:
+                game_state.winner = "Black" if board.turn == chess.WHITE else "White"
+                break
+            move = get_opening_move(board)
+            if move is None and len(board.move_stack) < EXPERIENCE_MAX_PLY:
+                move = get_smart_ai_move(board, game_state)  # Randomized, explores the opening
+            if move is None:
+                move = get_timed_ai_move(board, game_state)
+            ply = len(board.move_stack)
+            game_state.ai_last_moves = (game_state.ai_last_moves + [move])[-6:]
+            game_state.move_history.append((move, board.san(move)))  # score_smart_moves reads the game phase
+            board.push(move)
+            press_clock(game_state, not board.turn)
+            if ply < EXPERIENCE_MAX_PLY and ply not in game_state.search_scores:
+                # Book and exploration moves are not searched, score them for the store
+                game_state.search_scores[ply] = search_position(
+                    board, SELF_PLAY_SCORE_DEPTH, evaluate=game_state.search_evaluate
+                )
+                game_state.turn_start = time.time()  # Not on either player's clock
+        
+        outcome = board.outcome(claim_draw=True)
+        if outcome is not None and outcome.winner is not None:
+            game_state.winner = "White" if outcome.winner else "Black"
+        game_state.game_over = outcome is not None or game_state.winner is not None
+        result = game_result(game_state)
+        experience.record_game(chess.Board(), board.move_stack, result, game_state.search_scores)
+        print(f"Self-play game {game_number}/{games}: {result} in {len(board.move_stack)} plies")
+    experience.flush()
+
+def parse_args():
+    """Parse command-line options"""
+    parser = argparse.ArgumentParser(description="Enhanced Chess Game")
+    parser.add_argument("--analyze", metavar="PGN", help="Annotate every game in a PGN file instead of playing")
+    parser.add_argument("--output", metavar="PGN", help="Annotated PGN output (default: <input>.annotated.pgn)")
+    parser.add_argument("--depth", type=int, default=1, help="Search depth per position (default: 1)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted analysis run")
+    parser.add_argument("--nnue", metavar="NPZ", help="Use NNUE weights from a .npz file instead of evaluate_board")
+    parser.add_argument("--experience", metavar="DB", default=EXPERIENCE_PATH,
+                        help=f"Experience store file (default: {EXPERIENCE_PATH})")
+    parser.add_argument("--import-pgn", metavar="PGN", help="Add the games of a PGN file to the experience store")
+    parser.add_argument("--self-play", metavar="GAMES", type=int, help="Play the hard AI against itself and learn")
+    parser.add_argument("--bench-playouts", action="store_true", help="Measure MCTS playouts per second")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main() 
+    args = parse_args()
+    if args.analyze:
+        output_path = args.output or os.path.splitext(args.analyze)[0] + ".annotated.pgn"
+        run_batch_analysis(args.analyze, output_path, args.depth, args.workers, args.resume, args.nnue)
+    elif args.bench_playouts:
+        benchmark_playouts()
+    elif args.import_pgn or args.self_play:
+        experience = ExperienceStore(args.experience)
+        if args.import_pgn:
+            print(f"Imported {experience.import_pgn(args.import_pgn)} games")
+        if args.self_play:
+            run_self_play(args.self_play, experience)
+        experience.close()
+    else:
+        main(args.nnue, args.experience)